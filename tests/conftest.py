@@ -1,42 +1,60 @@
+import functools
 import os
 import pytest
+import pytest_asyncio
 import tempfile
-import shutil
+import socket
+import time
 from pathlib import Path
 import subprocess
+from ephemeral_port_reserve import reserve
 from pyln.testing.fixtures import *  # noqa: F403
 
+from nostr_sdk import Client, Keys, NostrSigner, RelayUrl
 
-@pytest.fixture
-def nostr_relay(worker_id, node_factory):
-    port = node_factory.get_unused_port()
 
+@functools.cache
+def relay_config_template():
     config_path = Path(__file__).parent / "config.toml"
     if not config_path.exists():
         raise FileNotFoundError(f"config.toml not found at {config_path}")
+    return config_path.read_text()
 
-    temp_dir = Path(tempfile.mkdtemp())
 
-    # Copy your original config.toml into it
-    original_config = Path(__file__).parent / "config.toml"
-    temp_config = temp_dir / "config.toml"
-    shutil.copy(original_config, temp_config)
+def wait_for_port(proc, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError(f"nostr-rs-relay exited with code {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"nostr-rs-relay not listening on port {port}")
+            time.sleep(0.05)
 
-    with temp_config.open("a") as f:
-        f.write(f"port = {port}\n")
 
+@pytest.fixture(scope="module")
+def nostr_relay(worker_id):
+    port = reserve()
+
+    temp_dir = Path(tempfile.mkdtemp())
+    temp_config = temp_dir / "config.toml"
+    temp_config.write_text(relay_config_template() + f"port = {port}\n")
+
+    # the relay outlives single tests now, don't let unread pipes fill up
+    log_file = (temp_dir / "relay.log").open("w")
     proc = subprocess.Popen(
         ["./nostr-rs-relay", "--config", str(temp_config), "--db", str(temp_dir)],
         cwd=Path(__file__).parent,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
         env=os.environ | {"RUST_LOG": "warn,nostr_rs_relay=debug"},
     )
 
     try:
-        import time
-
-        time.sleep(1.0)
+        wait_for_port(proc, port)
 
         ws_url = f"ws://127.0.0.1:{port}"
         yield ws_url
@@ -48,3 +66,15 @@ def nostr_relay(worker_id, node_factory):
         except subprocess.TimeoutExpired:
             proc.kill()
             proc.wait()
+        log_file.close()
+
+
+@pytest_asyncio.fixture
+async def nostr_client(nostr_relay):
+    client = Client(NostrSigner.keys(Keys.generate()))
+    await client.add_relay(RelayUrl.parse(nostr_relay))
+    await client.connect()
+
+    yield client
+
+    await client.shutdown()
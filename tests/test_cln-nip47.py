@@ -1,21 +1,23 @@
 import hashlib
 import inspect
-import json
 import logging
+import re
+import sys
 import time
 import asyncio
-from datetime import datetime, timedelta
-from typing import Any, Awaitable, Callable, Union
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Union
 
+import orjson
 import pytest
 from pyln.testing.fixtures import *  # noqa: F403
 from pyln.testing.utils import RpcError, wait_for, TIMEOUT
-from util import generate_random_label, get_plugin  # noqa: F401
+from util import generate_label, get_plugin  # noqa: F401
 
 from nostr_sdk import (
     Alphabet,
     Client,
-    RelayUrl,
     EventBuilder,
     Filter,
     Event,
@@ -35,29 +37,148 @@ from nostr_sdk import (
     SingleLetterTag,
     Tag,
     TagKind,
+    Timestamp,
     Method,
     PublicKey,
 )
 
 LOGGER = logging.getLogger(__name__)
 
+TEST2_SHA256 = hashlib.sha256(b"test2").hexdigest()
+# waits that are expected to see no events, success paths keep TIMEOUT
+NO_EVENT_TIMEOUT = 6
+BUDGET_EXCEEDED_RE = re.compile("Payment exceeds budget")
+D_TAG_KIND = TagKind.SINGLE_LETTER(SingleLetterTag.lowercase(Alphabet.D))
+INFO_CONTENT_READ_ONLY = frozenset(
+    "make_invoice lookup_invoice list_transactions get_balance get_info".split()
+)
+INFO_CONTENT_FULL = INFO_CONTENT_READ_ONLY | frozenset(
+    "pay_invoice multi_pay_invoice pay_keysend multi_pay_keysend".split()
+)
+EXPECTED_METHODS_READ_ONLY = (
+    Method.MAKE_INVOICE,
+    Method.LOOKUP_INVOICE,
+    Method.LIST_TRANSACTIONS,
+    Method.GET_BALANCE,
+    Method.GET_INFO,
+)
+EXPECTED_METHODS_FULL = EXPECTED_METHODS_READ_ONLY + (
+    Method.PAY_INVOICE,
+    Method.MULTI_PAY_INVOICE,
+    Method.PAY_KEYSEND,
+    Method.MULTI_PAY_KEYSEND,
+)
+
 
 class NotificationHandler(HandleNotification):
     def __init__(self, events_list, stop_after):
         self.events_list = events_list
         self.stop_after = stop_after
+        self._count = 0
         self._done = asyncio.Event()
 
     async def handle(self, relay_url, subscription_id, event: Event):
-        LOGGER.info(f"Received new event from {relay_url}: {event.as_json()}")
+        if LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info(f"Received new event from {relay_url}: {event.as_json()}")
         self.events_list.append(event)
-        if len(self.events_list) >= self.stop_after:
+        self._count += 1
+        if self._count >= self.stop_after:
             self._done.set()
 
     async def handle_msg(self, relay_url, msg):
         _var = None
 
 
+async def wait_event(event: asyncio.Event, timeout: float) -> None:
+    if sys.version_info >= (3, 11):
+        async with asyncio.timeout(timeout):
+            await event.wait()
+    else:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+
+
+def wait_for_budget(node, label: str, budget_msat: int, timeout: int = 15) -> None:
+    wait_for(
+        lambda: node.rpc.call("nip47-list", [label])[0][label]["budget_msat"]
+        == budget_msat,
+        timeout=timeout,
+    )
+
+
+async def create_invoices(node, specs: list[tuple[str, int]]) -> list[dict]:
+    return await asyncio.gather(
+        *(
+            asyncio.to_thread(
+                node.rpc.call,
+                "invoice",
+                {
+                    "label": generate_label(),
+                    "description": description,
+                    "amount_msat": amount_msat,
+                },
+            )
+            for description, amount_msat in specs
+        )
+    )
+
+
+async def fetch_invoice_info(node, bolt11: str) -> tuple[dict, dict]:
+    listinvoices, decoded = await asyncio.gather(
+        asyncio.to_thread(node.rpc.call, "listinvoices", {"invstring": bolt11}),
+        asyncio.to_thread(node.rpc.call, "decode", [bolt11]),
+    )
+    return (listinvoices["invoices"][0], decoded)
+
+
+async def set_budget_and_verify(
+    node,
+    nwc: Nwc,
+    label: str,
+    budget_msat: int,
+    interval: Optional[str] = None,
+    expected: Optional[int] = None,
+) -> None:
+    params = (
+        [label, budget_msat] if interval is None else [label, budget_msat, interval]
+    )
+    # keep the loop free for relay notifications while lightningd answers
+    await asyncio.to_thread(node.rpc.call, "nip47-budget", params)
+    balance = await nwc.get_balance()
+    assert balance == (budget_msat if expected is None else expected)
+
+
+def restart_plugin(node, plugin_path, options: Optional[dict] = None) -> int:
+    # events published after this belong to the restarted plugin
+    restarted_at = int(time.time()) + 1
+    node.rpc.call("plugin", {"subcommand": "stop", "plugin": "cln-nip47"})
+    node.rpc.call(
+        "plugin",
+        {"subcommand": "start", "plugin": str(plugin_path)} | (options or {}),
+    )
+    node.daemon.wait_for_log("All NWC's loaded")
+    return restarted_at
+
+
+def spendable_msat(node, peer_id: str) -> int:
+    return node.rpc.call("listpeerchannels", [peer_id])["channels"][0]["spendable_msat"]
+
+
+async def wait_until(
+    fetch: Callable[[], Awaitable[Any]],
+    predicate: Callable[[Any], bool],
+    timeout: float = TIMEOUT,
+    interval: float = 0.25,
+) -> Any:
+    deadline = time.monotonic() + timeout
+    while True:
+        value = await fetch()
+        if predicate(value):
+            return value
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Condition not met after {timeout}s, last: {value}")
+        await asyncio.sleep(interval)
+
+
 Action = Union[
     Callable[[], Awaitable[None]],
     Callable[[], None],
@@ -75,13 +196,16 @@ async def fetch_event_responses(
 ) -> tuple[list[Event], Any]:
     events = []
     response_filter = Filter().kind(Kind(event_kind)).pubkey(client_pubkey)
-    await client.subscribe(response_filter)
-
     handler = NotificationHandler(events, stop_after)
     task = asyncio.create_task(client.handle_notifications(handler))
-
-    time.sleep(1)
-    if inspect.iscoroutine(action):
+    # let the handler attach before the relay answers the subscription
+    await asyncio.sleep(0)
+    subscription = await client.subscribe(response_filter)
+
+    # NWC responses and notifications are ephemeral, the relay only forwards
+    # them to subscriptions that are already live when they arrive
+    await asyncio.sleep(1)
+    if asyncio.iscoroutine(action):
         action_result = await action
     elif inspect.iscoroutinefunction(action):
         action_result = await action()
@@ -91,7 +215,7 @@ async def fetch_event_responses(
         raise TypeError("action must be a callable or an awaitable")
 
     try:
-        await asyncio.wait_for(handler._done.wait(), timeout=timeout)
+        await wait_event(handler._done, timeout)
     except asyncio.TimeoutError:
         print(
             f"Timeout reached after {timeout} seconds, collected {len(events)} events"
@@ -103,38 +227,200 @@ async def fetch_event_responses(
         except asyncio.CancelledError:
             pass
 
-    await client.unsubscribe_all()
+    await client.unsubscribe(subscription.id)
     assert len(events) == stop_after
     return (events, action_result)
 
 
+class InfoEventWatcher(HandleNotification):
+    def __init__(self, author: PublicKey):
+        self.author_hex = author.to_hex()
+        self.latest: Optional[Event] = None
+        self._changed = asyncio.Event()
+
+    async def handle(self, relay_url, subscription_id, event: Event):
+        if event.kind().as_u16() != 13194 or event.author().to_hex() != self.author_hex:
+            return
+        # a republish can land in the same second as the event it replaces
+        if self.latest is None or event.created_at().as_secs() >= (
+            self.latest.created_at().as_secs()
+        ):
+            self.latest = event
+            self._changed.set()
+
+    def seed(self, event: Event):
+        # a live event from the same second is the republish, keep it
+        if self.latest is None or event.created_at().as_secs() > (
+            self.latest.created_at().as_secs()
+        ):
+            self.latest = event
+            self._changed.set()
+
+    async def handle_msg(self, relay_url, msg):
+        _var = None
+
+    async def wait_for(
+        self,
+        predicate: Callable[[Event], bool] = lambda _: True,
+        timeout: float = TIMEOUT,
+    ) -> Event:
+        deadline = time.monotonic() + timeout
+        while self.latest is None or not predicate(self.latest):
+            self._changed.clear()
+            await wait_event(self._changed, max(0, deadline - time.monotonic()))
+        return self.latest
+
+
+@asynccontextmanager
+async def watch_info_events(
+    client: Client, uri: NostrWalletConnectUri
+) -> AsyncIterator[InfoEventWatcher]:
+    watcher = InfoEventWatcher(uri.public_key())
+    task = asyncio.create_task(client.handle_notifications(watcher))
+    # let the handler attach before the relay answers the subscription
+    await asyncio.sleep(0)
+    info_filter = Filter().kind(Kind(13194)).author(uri.public_key())
+    subscription = await client.subscribe(info_filter)
+    # the client notifies every event id only once, so a stored info event it
+    # already fetched is never redelivered to this subscription
+    stored = await client.fetch_events(
+        info_filter.limit(1), timeout=timedelta(seconds=TIMEOUT)
+    )
+    if stored.len() > 0:
+        watcher.seed(stored.first())
+    try:
+        yield watcher
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await client.unsubscribe(subscription.id)
+
+
 async def fetch_info_event(
     client: Client,
     uri: NostrWalletConnectUri,
+    since: Optional[int] = None,
 ) -> Event:
-    response_filter = Filter().kind(Kind(13194)).author(uri.public_key())
+    response_filter = Filter().kind(Kind(13194)).author(uri.public_key()).limit(1)
+    if since is not None:
+        response_filter = response_filter.since(Timestamp.from_secs(since))
     events = await client.fetch_events(
         response_filter, timeout=timedelta(seconds=TIMEOUT)
     )
-    start_time = datetime.now()
-    while events.len() < 1 and (datetime.now() - start_time) < timedelta(
-        seconds=TIMEOUT
-    ):
-        time.sleep(1)
-        events = await client.fetch_events(
-            response_filter, timeout=timedelta(seconds=1)
-        )
+    if events.len() == 0:
+        # not published yet, wait for it instead of re-fetching
+        async with watch_info_events(client, uri) as info_events:
+            return await info_events.wait_for(
+                lambda e: since is None or e.created_at().as_secs() >= since
+            )
     assert events.len() == 1
 
     return events.first()
 
 
+def index_tags(event: Event) -> dict[str, Optional[str]]:
+    return {tag.as_vec()[0]: tag.content() for tag in event.tags().to_vec()}
+
+
+def assert_node_info(get_info, node_get_info: dict) -> None:
+    assert get_info.alias == node_get_info["alias"]
+    assert get_info.block_height == node_get_info["blockheight"]
+    assert get_info.color == node_get_info["color"]
+    assert get_info.network == "regtest"
+    assert get_info.pubkey == node_get_info["id"]
+
+
+def assert_capabilities(
+    get_info, info_event: Event, read_only: bool, notifications: bool
+) -> None:
+    if read_only:
+        assert tuple(get_info.methods) == EXPECTED_METHODS_READ_ONLY
+        content = INFO_CONTENT_READ_ONLY
+    else:
+        assert tuple(get_info.methods) == EXPECTED_METHODS_FULL
+        content = INFO_CONTENT_FULL
+    # capabilities are an unordered, space separated list
+    info_content = info_event.content().split()
+    assert len(info_content) == len(set(info_content))
+    info_tags = index_tags(info_event)
+    assert info_tags["encryption"] == "nip44_v2 nip04"
+    if notifications:
+        assert frozenset(info_content) == content | {"notifications"}
+        assert info_tags["notifications"] == "payment_received payment_sent"
+    else:
+        assert frozenset(info_content) == content
+        assert "notifications" not in info_tags
+
+
+async def build_request_event(
+    signer: NostrSigner,
+    wallet_pubkey: PublicKey,
+    content: dict,
+    nip44: bool = False,
+) -> Event:
+    encrypt = signer.nip44_encrypt if nip44 else signer.nip04_encrypt
+    encrypted_content = await encrypt(wallet_pubkey, orjson.dumps(content).decode())
+    return (
+        await EventBuilder(Kind(23194), encrypted_content)
+        .tags([Tag.public_key(wallet_pubkey)])
+        .sign(signer)
+    )
+
+
+async def decrypt_responses(
+    signer: NostrSigner,
+    public_key: PublicKey,
+    events: list[Event],
+    nip44: bool = False,
+) -> list[dict]:
+    decrypt = signer.nip44_decrypt if nip44 else signer.nip04_decrypt
+    contents = await asyncio.gather(
+        *(decrypt(public_key, event.content()) for event in events)
+    )
+    return [orjson.loads(content) for content in contents]
+
+
+async def classify_responses(
+    signer: NostrSigner,
+    public_key: PublicKey,
+    events: list[Event],
+    nip44: bool = False,
+) -> tuple[list[tuple[Event, dict]], list[tuple[Event, dict]]]:
+    contents = await decrypt_responses(signer, public_key, events, nip44)
+    successes = []
+    errors = []
+    # a response carries either a result or an error, never both
+    for event, content in zip(events, contents):
+        if content.get("error") is not None:
+            errors.append((event, content))
+        else:
+            assert content.get("result") is not None
+            successes.append((event, content))
+    return (successes, errors)
+
+
+async def connect_nwc(
+    client: Client,
+    uri_str: str,
+    since: Optional[int] = None,
+) -> tuple[NostrWalletConnectUri, Nwc]:
+    LOGGER.info(uri_str)
+    uri = NostrWalletConnectUri.parse(uri_str)
+    await fetch_info_event(client, uri, since)
+    return (uri, Nwc(uri))
+
+
 @pytest.mark.asyncio
-async def test_get_balance(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_get_balance(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2 = node_factory.line_graph(
         2,
-        wait_for_announce=True,
         opts=[
             {
                 "log-level": "debug",
@@ -146,49 +432,30 @@ async def test_get_balance(nostr_relay, node_factory, get_plugin):  # noqa: F811
         ],
     )
     node_balance = l1.rpc.call("listpeerchannels", {})["channels"][0]["spendable_msat"]
-    uri_str = l1.rpc.call("nip47-create", ["test1", 3000])["uri"]
-    LOGGER.info(uri_str)
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
-    balance = await nwc.get_balance()
-    assert balance == 3000
 
-    uri_str = l1.rpc.call("nip47-create", ["test2"])["uri"]
-    LOGGER.info(uri_str)
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
-    balance = await nwc.get_balance()
-    assert balance == node_balance
+    async def run_balance_check(name, budget, expected):
+        params = [name] if budget is None else [name, budget]
+        uri_str = l1.rpc.call("nip47-create", params)["uri"]
+        _uri, nwc = await connect_nwc(client, uri_str)
+        balance = await nwc.get_balance()
+        assert balance == expected
 
-    uri_str = l1.rpc.call("nip47-create", ["test3", 0])["uri"]
-    LOGGER.info(uri_str)
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
-    balance = await nwc.get_balance()
-    assert balance == 0
+    await asyncio.gather(
+        run_balance_check("test1", 3000, 3000),
+        run_balance_check("test2", None, node_balance),
+        run_balance_check("test3", 0, 0),
+    )
 
     with pytest.raises(RpcError, match="not an integer"):
-        uri_str = l1.rpc.call("nip47-create", ["test3", -1])["uri"]
+        l1.rpc.call("nip47-create", ["test3", -1])
 
 
 @pytest.mark.asyncio
-async def test_get_info(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_get_info(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1 = node_factory.get_node(
         options={
             "log-level": "debug",
@@ -201,106 +468,38 @@ async def test_get_info(nostr_relay, node_factory, get_plugin):  # noqa: F811
     uri_str = l1.rpc.call("nip47-create", ["test1", 3000])["uri"]
     LOGGER.info(uri_str)
     uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
+    info_event = await fetch_info_event(client, uri)
     nwc = Nwc(uri)
     get_info = await nwc.get_info()
-    assert get_info.alias == node_get_info["alias"]
-    assert get_info.block_height == node_get_info["blockheight"]
-    assert get_info.color == node_get_info["color"]
-    assert get_info.methods == [
-        Method.MAKE_INVOICE,
-        Method.LOOKUP_INVOICE,
-        Method.LIST_TRANSACTIONS,
-        Method.GET_BALANCE,
-        Method.GET_INFO,
-        Method.PAY_INVOICE,
-        Method.MULTI_PAY_INVOICE,
-        Method.PAY_KEYSEND,
-        Method.MULTI_PAY_KEYSEND,
-    ]
-    assert get_info.network == "regtest"
+    assert_node_info(get_info, node_get_info)
     assert get_info.notifications == ["payment_received", "payment_sent"]
-    assert get_info.pubkey == node_get_info["id"]
+    assert_capabilities(get_info, info_event, read_only=False, notifications=True)
 
-    l1.rpc.call("plugin", {"subcommand": "stop", "plugin": "cln-nip47"})
-    l1.rpc.call(
-        "plugin",
-        {
-            "subcommand": "start",
-            "plugin": str(get_plugin),
-            "nip47-notifications": False,
-        },
-    )
-    l1.daemon.wait_for_log("All NWC's loaded")
-    time.sleep(5)
-    await client.connect()
-    info_event = await fetch_info_event(client, uri)
+    restarted_at = restart_plugin(l1, get_plugin, {"nip47-notifications": False})
+    # the plugin only subscribes to requests after publishing its info event
+    info_event = await fetch_info_event(client, uri, restarted_at)
     get_info = await nwc.get_info()
-    assert get_info.alias == node_get_info["alias"]
-    assert get_info.block_height == node_get_info["blockheight"]
-    assert get_info.color == node_get_info["color"]
-    assert get_info.methods == [
-        Method.MAKE_INVOICE,
-        Method.LOOKUP_INVOICE,
-        Method.LIST_TRANSACTIONS,
-        Method.GET_BALANCE,
-        Method.GET_INFO,
-        Method.PAY_INVOICE,
-        Method.MULTI_PAY_INVOICE,
-        Method.PAY_KEYSEND,
-        Method.MULTI_PAY_KEYSEND,
-    ]
-    assert get_info.network == "regtest"
+    assert_node_info(get_info, node_get_info)
     assert get_info.notifications == []
-    assert get_info.pubkey == node_get_info["id"]
-
-    assert (
-        info_event.content()
-        == "make_invoice lookup_invoice list_transactions get_balance get_info pay_invoice multi_pay_invoice pay_keysend multi_pay_keysend"
-    )
-    assert (
-        info_event.tags().find(TagKind.UNKNOWN("encryption")).content()
-        == "nip44_v2 nip04"
-    )
-    assert info_event.tags().find(TagKind.UNKNOWN("notifications")) is None
+    assert_capabilities(get_info, info_event, read_only=False, notifications=False)
 
     uri_str = l1.rpc.call("nip47-create", ["test2", 0])["uri"]
     LOGGER.info(uri_str)
     uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
+    info_event = await fetch_info_event(client, uri)
     nwc = Nwc(uri)
     get_info = await nwc.get_info()
-    assert get_info.methods == [
-        Method.MAKE_INVOICE,
-        Method.LOOKUP_INVOICE,
-        Method.LIST_TRANSACTIONS,
-        Method.GET_BALANCE,
-        Method.GET_INFO,
-    ]
-
-    info_event = await fetch_info_event(client, uri)
-    assert (
-        info_event.content()
-        == "make_invoice lookup_invoice list_transactions get_balance get_info"
-    )
-    assert (
-        info_event.tags().find(TagKind.UNKNOWN("encryption")).content()
-        == "nip44_v2 nip04"
-    )
-    assert info_event.tags().find(TagKind.UNKNOWN("notifications")) is None
+    assert_node_info(get_info, node_get_info)
+    assert get_info.notifications == []
+    assert_capabilities(get_info, info_event, read_only=True, notifications=False)
 
 
 @pytest.mark.asyncio
-async def test_make_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_make_invoice(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1 = node_factory.get_node(
         options={
             "log-level": "debug",
@@ -310,14 +509,7 @@ async def test_make_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F81
         broken_log=r"Relay receiver exited with error|Connection failed",
     )
     uri_str = l1.rpc.call("nip47-create", ["test1", 3000])["uri"]
-    LOGGER.info(uri_str)
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
+    uri, nwc = await connect_nwc(client, uri_str)
     timestamp = int(time.time())
     invoice = await nwc.make_invoice(
         MakeInvoiceRequest(
@@ -342,14 +534,11 @@ async def test_make_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F81
         MakeInvoiceRequest(
             amount=3001,
             description="test2",
-            description_hash=hashlib.sha256("test2".encode()).hexdigest(),
+            description_hash=TEST2_SHA256,
             expiry=120,
         )
     )
-    node_invoice = l1.rpc.call("listinvoices", {"invstring": invoice.invoice})[
-        "invoices"
-    ][0]
-    node_invoice_decode = l1.rpc.call("decode", [invoice.invoice])
+    node_invoice, node_invoice_decode = await fetch_invoice_info(l1, invoice.invoice)
     assert invoice.payment_hash == node_invoice["payment_hash"]
     assert node_invoice["amount_msat"] == invoice.amount
     assert timestamp + node_invoice_decode["expiry"] == pytest.approx(
@@ -368,7 +557,7 @@ async def test_make_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F81
             MakeInvoiceRequest(
                 amount=3001,
                 description=None,
-                description_hash=hashlib.sha256("test2".encode()).hexdigest(),
+                description_hash=TEST2_SHA256,
                 expiry=120,
             )
         )
@@ -379,15 +568,18 @@ async def test_make_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F81
             MakeInvoiceRequest(
                 amount=3001,
                 description="test1",
-                description_hash=hashlib.sha256("test2".encode()).hexdigest(),
+                description_hash=TEST2_SHA256,
                 expiry=120,
             )
         )
 
 
 @pytest.mark.asyncio
-async def test_pay_keysend(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_pay_keysend(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2, l3 = node_factory.line_graph(
         3,
         wait_for_announce=True,
@@ -403,14 +595,7 @@ async def test_pay_keysend(nostr_relay, node_factory, get_plugin):  # noqa: F811
         ],
     )
     uri_str = l1.rpc.call("nip47-create", ["test1", 3000])["uri"]
-    LOGGER.info(uri_str)
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
+    uri, nwc = await connect_nwc(client, uri_str)
     result = await nwc.pay_keysend(
         PayKeysendRequest(
             id="id123", amount=1000, pubkey=l3.info["id"], preimage=None, tlv_records=[]
@@ -421,7 +606,7 @@ async def test_pay_keysend(nostr_relay, node_factory, get_plugin):  # noqa: F811
     assert result.fees_paid == pay["amount_sent_msat"] - pay["amount_msat"]
     assert result.fees_paid == 1
 
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
+    with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
         await nwc.pay_keysend(
             PayKeysendRequest(
                 id="id123",
@@ -446,8 +631,11 @@ async def test_pay_keysend(nostr_relay, node_factory, get_plugin):  # noqa: F811
 
 
 @pytest.mark.asyncio
-async def test_multi_keysend(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_multi_keysend(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2, l3 = node_factory.line_graph(
         3,
         wait_for_announce=True,
@@ -467,7 +655,7 @@ async def test_multi_keysend(nostr_relay, node_factory, get_plugin):  # noqa: F8
     client_pubkey = PublicKey.parse(uri_res["clientkey_public"])
     LOGGER.info(uri_str)
     uri = NostrWalletConnectUri.parse(uri_str)
-    content = {
+    content1 = {
         "method": "multi_pay_keysend",
         "params": {
             "keysends": [
@@ -476,22 +664,7 @@ async def test_multi_keysend(nostr_relay, node_factory, get_plugin):  # noqa: F8
             ],
         },
     }
-    content = json.dumps(content)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    encrypted_content = await signer.nip04_encrypt(uri.public_key(), content)
-    event = (
-        await EventBuilder(Kind(23194), encrypted_content)
-        .tags([Tag.public_key(uri.public_key())])
-        .sign(signer)
-    )
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    (responses1, _res) = await fetch_event_responses(
-        client, client_pubkey, 23195, client.send_event(event), 2
-    )
-
-    content = {
+    content2 = {
         "method": "multi_pay_keysend",
         "params": {
             "keysends": [
@@ -500,47 +673,45 @@ async def test_multi_keysend(nostr_relay, node_factory, get_plugin):  # noqa: F8
             ],
         },
     }
-    content = json.dumps(content)
-    encrypted_content = await signer.nip04_encrypt(uri.public_key(), content)
-    event = (
-        await EventBuilder(Kind(23194), encrypted_content)
-        .tags([Tag.public_key(uri.public_key())])
-        .sign(signer)
+    signer = NostrSigner.keys(Keys(uri.secret()))
+    wallet_pubkey = uri.public_key()
+    event1, event2 = await asyncio.gather(
+        build_request_event(signer, wallet_pubkey, content1),
+        build_request_event(signer, wallet_pubkey, content2),
+    )
+    (responses1, _res) = await fetch_event_responses(
+        client, client_pubkey, 23195, client.send_event(event1), 2
     )
     (responses2, _res) = await fetch_event_responses(
-        client, client_pubkey, 23195, client.send_event(event), 2
+        client, client_pubkey, 23195, client.send_event(event2), 2
     )
 
     reponses = responses1 + responses2
 
-    error_events = []
-    success_events = []
     for event in reponses:
         LOGGER.info(event)
-        assert event.tags().find(
-            TagKind.SINGLE_LETTER(SingleLetterTag.lowercase(Alphabet.D))
-        )
-        content = await signer.nip04_decrypt(uri.public_key(), event.content())
-        content = json.loads(content)
-        if "result" in content and content["result"] is not None:
-            success_events.append(content)
-        if "error" in content and content["error"] is not None:
-            error_events.append(content)
+        assert event.tags().find(D_TAG_KIND)
+    success_events, error_events = await classify_responses(
+        signer, wallet_pubkey, reponses
+    )
 
     assert len(success_events) == 3
     assert len(error_events) == 1
-    for content in success_events:
+    for _event, content in success_events:
         assert content["result_type"] == "multi_pay_keysend"
         assert content["result"]["preimage"] is not None
-    for content in error_events:
+    for _event, content in error_events:
         assert content["result_type"] == "multi_pay_keysend"
         assert content["error"]["message"] == "Payment exceeds budget!"
         assert content["error"]["code"] == "QUOTA_EXCEEDED"
 
 
 @pytest.mark.asyncio
-async def test_lookup_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_lookup_invoice(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2, l3 = node_factory.line_graph(
         3,
         wait_for_announce=True,
@@ -562,29 +733,14 @@ async def test_lookup_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F
                 "invoice",
                 {
                     "amount_msat": 500000000,
-                    "label": generate_random_label(),
+                    "label": generate_label(),
                     "description": "balancechannel",
                 },
             )["bolt11"]
         },
     )
-    wait_for(
-        lambda: (
-            l2.rpc.call("listpeerchannels", [l1.info["id"]])["channels"][0][
-                "spendable_msat"
-            ]
-            > 3001
-        )
-    )
     uri_str = l1.rpc.call("nip47-create", ["test1", 3000])["uri"]
-    LOGGER.info(uri_str)
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
+    uri, nwc = await connect_nwc(client, uri_str)
     invoice = await nwc.make_invoice(
         MakeInvoiceRequest(
             amount=3000, description="test1", description_hash=None, expiry=None
@@ -601,10 +757,7 @@ async def test_lookup_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F
             )
         )
 
-    listpays_rpc = l1.rpc.call("listinvoices", {"invstring": invoice.invoice})[
-        "invoices"
-    ][0]
-    invoice_decode = l1.rpc.call("decode", [invoice.invoice])
+    listpays_rpc, invoice_decode = await fetch_invoice_info(l1, invoice.invoice)
 
     invoice_lookup = await nwc.lookup_invoice(
         LookupInvoiceRequest(
@@ -656,15 +809,12 @@ async def test_lookup_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F
         MakeInvoiceRequest(
             amount=3001,
             description="test2",
-            description_hash=hashlib.sha256("test2".encode()).hexdigest(),
+            description_hash=TEST2_SHA256,
             expiry=1000,
         )
     )
 
-    listpays_rpc = l1.rpc.call("listinvoices", {"invstring": invoice.invoice})[
-        "invoices"
-    ][0]
-    invoice_decode = l1.rpc.call("decode", [invoice.invoice])
+    listpays_rpc, invoice_decode = await fetch_invoice_info(l1, invoice.invoice)
 
     invoice_lookup = await nwc.lookup_invoice(
         LookupInvoiceRequest(
@@ -678,9 +828,7 @@ async def test_lookup_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F
     assert invoice_lookup.created_at.as_secs() == pytest.approx(
         invoice_decode["created_at"], abs=3
     )
-    assert (
-        invoice_lookup.description_hash == hashlib.sha256("test2".encode()).hexdigest()
-    )
+    assert invoice_lookup.description_hash == TEST2_SHA256
     assert invoice_lookup.expires_at.as_secs() == pytest.approx(
         listpays_rpc["expires_at"], abs=3
     )
@@ -691,25 +839,26 @@ async def test_lookup_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F
     assert invoice_lookup.state.name == "PENDING"
     assert invoice_lookup.settled_at is None
 
+    # the balancing payment has settled by now, this rarely has to poll
+    wait_for(lambda: spendable_msat(l2, l1.info["id"]) > 3001)
     l2.rpc.call("pay", {"bolt11": invoice.invoice})
-    listpays_rpc = l1.rpc.call("listinvoices", {"invstring": invoice.invoice})[
-        "invoices"
-    ][0]
-    invoice_lookup = await nwc.lookup_invoice(
-        LookupInvoiceRequest(
-            payment_hash=invoice.payment_hash,
-            invoice=None,
-        )
+    listinvoices_rpc, invoice_lookup = await asyncio.gather(
+        asyncio.to_thread(l1.rpc.call, "listinvoices", {"invstring": invoice.invoice}),
+        nwc.lookup_invoice(
+            LookupInvoiceRequest(
+                payment_hash=invoice.payment_hash,
+                invoice=None,
+            )
+        ),
     )
+    listpays_rpc = listinvoices_rpc["invoices"][0]
     assert invoice_lookup.invoice == invoice.invoice
     assert invoice_lookup.amount == 3001
     assert invoice_lookup.description is None
     assert invoice_lookup.created_at.as_secs() == pytest.approx(
         invoice_decode["created_at"], abs=3
     )
-    assert (
-        invoice_lookup.description_hash == hashlib.sha256("test2".encode()).hexdigest()
-    )
+    assert invoice_lookup.description_hash == TEST2_SHA256
     assert invoice_lookup.expires_at.as_secs() == pytest.approx(
         listpays_rpc["expires_at"], abs=3
     )
@@ -726,7 +875,7 @@ async def test_lookup_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F
         "invoice",
         {
             "amount_msat": 4000,
-            "label": generate_random_label(),
+            "label": generate_label(),
             "description": "outgoing",
         },
     )
@@ -771,8 +920,11 @@ async def test_lookup_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F
 
 
 @pytest.mark.asyncio
-async def test_list_transactions(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_list_transactions(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2 = node_factory.line_graph(
         2,
         wait_for_announce=True,
@@ -793,49 +945,42 @@ async def test_list_transactions(nostr_relay, node_factory, get_plugin):  # noqa
                 "invoice",
                 {
                     "amount_msat": 500000000,
-                    "label": generate_random_label(),
+                    "label": generate_label(),
                     "description": "balancechannel",
                 },
             )["bolt11"]
         },
     )
-    wait_for(
-        lambda: (
-            l2.rpc.call("listpeerchannels", [l1.info["id"]])["channels"][0][
-                "spendable_msat"
-            ]
-            > 30001
-        )
-    )
+    wait_for(lambda: spendable_msat(l2, l1.info["id"]) > 30001)
     uri_str = l1.rpc.call("nip47-create", ["test1"])["uri"]
-    LOGGER.info(uri_str)
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
-    for i in range(10):
-        invoice = l2.rpc.call(
-            "invoice",
-            {
-                "label": generate_random_label(),
-                "description": "test1",
-                "amount_msat": 3000,
-            },
-        )
-        result = await nwc.pay_invoice(
-            PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
+    uri, nwc = await connect_nwc(client, uri_str)
+    invoices = await create_invoices(l2, [("test1", 3000)] * 10)
+    results = await asyncio.gather(
+        *(
+            nwc.pay_invoice(
+                PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
+            )
+            for invoice in invoices
         )
-        assert result.preimage is not None
-    for i in range(10):
-        invoice = await nwc.make_invoice(
-            MakeInvoiceRequest(
-                amount=3000, description="test2", description_hash=None, expiry=None
+    )
+    assert all(result.preimage is not None for result in results)
+
+    invoices = await asyncio.gather(
+        *(
+            nwc.make_invoice(
+                MakeInvoiceRequest(
+                    amount=3000, description="test2", description_hash=None, expiry=None
+                )
             )
+            for _ in range(10)
+        )
+    )
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(l2.rpc.call, "pay", [invoice.invoice])
+            for invoice in invoices
         )
-        result = l2.rpc.call("pay", [invoice.invoice])
+    )
 
     invoice = await nwc.make_invoice(
         MakeInvoiceRequest(
@@ -856,24 +1001,30 @@ async def test_list_transactions(nostr_relay, node_factory, get_plugin):  # noqa
     )
     assert len(result) == 22
     for tx in result:
-        tx.description is not None
-        tx.invoice is not None
-        tx.amount is not None
-        tx.created_at is not None
-        tx.description_hash is None
-        tx.expires_at is None
-        tx.preimage is not None
-        tx.settled_at is not None
-        tx.metadata is None
-        tx.transaction_type is not None
-        tx.state is not None
-        tx.payment_hash is not None
-        tx.fees_paid is not None
+        assert tx.description is not None
+        assert tx.invoice is not None
+        assert tx.amount is not None
+        assert tx.created_at is not None
+        assert tx.description_hash is None
+        assert tx.transaction_type is not None
+        if tx.transaction_type.name == "OUTGOING":
+            assert tx.expires_at is None
+        else:
+            assert tx.expires_at is not None
+        assert tx.preimage is not None
+        assert tx.settled_at is not None
+        assert tx.metadata is None
+        assert tx.state is not None
+        assert tx.payment_hash is not None
+        assert tx.fees_paid is not None
 
 
 @pytest.mark.asyncio
-async def test_notifications(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_notifications(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2, l3 = node_factory.line_graph(
         3,
         wait_for_announce=True,
@@ -891,20 +1042,12 @@ async def test_notifications(nostr_relay, node_factory, get_plugin):  # noqa: F8
     uri_res = l1.rpc.call("nip47-create", ["test1"])
     uri_str = uri_res["uri"]
     client_pubkey = PublicKey.parse(uri_res["clientkey_public"])
-    LOGGER.info(uri_str)
-
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
+    uri, nwc = await connect_nwc(client, uri_str)
 
     invoice = l3.rpc.call(
         "invoice",
         {
-            "label": generate_random_label(),
+            "label": generate_label(),
             "description": "test1",
             "amount_msat": 500000000,
         },
@@ -918,27 +1061,19 @@ async def test_notifications(nostr_relay, node_factory, get_plugin):  # noqa: F8
         1,
     )
 
-    invoice1_rpc = l3.rpc.call("listinvoices", {"invstring": invoice["bolt11"]})[
-        "invoices"
-    ][0]
-    invoice1_decode = l3.rpc.call("decode", [invoice["bolt11"]])
-    pay1_list = l1.rpc.call("listpays", {"bolt11": invoice["bolt11"]})["pays"][0]
-
-    wait_for(
-        lambda: (
-            l2.rpc.call("listpeerchannels", [l1.info["id"]])["channels"][0][
-                "spendable_msat"
-            ]
-            > 3000
-        )
+    invoice1_rpcs, invoice1_decode, pay1_lists = await asyncio.gather(
+        asyncio.to_thread(
+            l3.rpc.call, "listinvoices", {"invstring": invoice["bolt11"]}
+        ),
+        asyncio.to_thread(l3.rpc.call, "decode", [invoice["bolt11"]]),
+        asyncio.to_thread(l1.rpc.call, "listpays", {"bolt11": invoice["bolt11"]}),
     )
+    invoice1_rpc = invoice1_rpcs["invoices"][0]
+    pay1_list = pay1_lists["pays"][0]
+
     wait_for(
-        lambda: (
-            l3.rpc.call("listpeerchannels", [l2.info["id"]])["channels"][0][
-                "spendable_msat"
-            ]
-            > 3000
-        )
+        lambda: spendable_msat(l2, l1.info["id"]) > 3000
+        and spendable_msat(l3, l2.info["id"]) > 3000
     )
 
     result = await nwc.make_invoice(
@@ -953,20 +1088,15 @@ async def test_notifications(nostr_relay, node_factory, get_plugin):  # noqa: F8
         lambda: l3.rpc.call("pay", [result.invoice]),
         1,
     )
-    invoice2_list = l1.rpc.call("listinvoices", {"invstring": result.invoice})[
-        "invoices"
-    ][0]
-    invoice2_decode = l3.rpc.call("decode", [result.invoice])
+    invoice2_list, invoice2_decode = await fetch_invoice_info(l1, result.invoice)
 
     responses = responses1 + responses2
-    LOGGER.info(f"response1: {responses1} response2: {responses2}")
+    LOGGER.info("response1: %s response2: %s", responses1, responses2)
     assert len(responses) == 2
     signer = NostrSigner.keys(Keys(uri.secret()))
     received_events = []
     sent_events = []
-    for event in responses:
-        content = await signer.nip04_decrypt(uri.public_key(), event.content())
-        content = json.loads(content)
+    for content in await decrypt_responses(signer, uri.public_key(), responses):
         LOGGER.info(content)
         if content["notification_type"] == "payment_received":
             received_events.append(content)
@@ -1011,24 +1141,13 @@ async def test_notifications(nostr_relay, node_factory, get_plugin):  # noqa: F8
     )
     assert "metadata" not in sent_events[0]["notification"]
 
-    l1.rpc.call("plugin", {"subcommand": "stop", "plugin": "cln-nip47"})
-    l1.rpc.call(
-        "plugin",
-        {
-            "subcommand": "start",
-            "plugin": str(get_plugin),
-            "nip47-notifications": False,
-        },
-    )
-    l1.daemon.wait_for_log("All NWC's loaded")
-    time.sleep(3)
-    await client.connect()
-    await fetch_info_event(client, uri)
+    restarted_at = restart_plugin(l1, get_plugin, {"nip47-notifications": False})
+    await fetch_info_event(client, uri, restarted_at)
 
     invoice = l3.rpc.call(
         "invoice",
         {
-            "label": generate_random_label(),
+            "label": generate_label(),
             "description": "test3",
             "amount_msat": 500,
         },
@@ -1042,13 +1161,16 @@ async def test_notifications(nostr_relay, node_factory, get_plugin):  # noqa: F8
                 PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
             ),
             1,
-            6,
+            NO_EVENT_TIMEOUT,
         )
 
 
 @pytest.mark.asyncio
-async def test_pay_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_pay_invoice(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2 = node_factory.line_graph(
         2,
         wait_for_announce=True,
@@ -1063,45 +1185,32 @@ async def test_pay_invoice(nostr_relay, node_factory, get_plugin):  # noqa: F811
         ],
     )
     uri_str = l1.rpc.call("nip47-create", ["test1", 3001])["uri"]
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    LOGGER.info(uri_str)
-    invoice = l2.rpc.call(
-        "invoice",
-        {"label": generate_random_label(), "description": "test1", "amount_msat": 3000},
+    uri, nwc = await connect_nwc(client, uri_str)
+    invoice1, invoice2, invoice3 = await create_invoices(
+        l2, [("test1", 3000), ("test2", 1), ("test3", 2)]
     )
-    nwc = Nwc(NostrWalletConnectUri.parse(uri_str))
     result = await nwc.pay_invoice(
-        PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
+        PayInvoiceRequest(id=None, amount=None, invoice=invoice1["bolt11"])
     )
-    pay = l1.rpc.call("listpays", {"payment_hash": invoice["payment_hash"]})["pays"][0]
+    pay = l1.rpc.call("listpays", {"payment_hash": invoice1["payment_hash"]})["pays"][0]
     assert result.preimage == pay["preimage"]
 
-    invoice = l2.rpc.call(
-        "invoice",
-        {"label": generate_random_label(), "description": "test2", "amount_msat": 1},
-    )
     with pytest.raises(NostrSdkError.Generic, match="unnecessary"):
         await nwc.pay_invoice(
-            PayInvoiceRequest(id=None, amount=1, invoice=invoice["bolt11"])
+            PayInvoiceRequest(id=None, amount=1, invoice=invoice2["bolt11"])
         )
-    invoice = l2.rpc.call(
-        "invoice",
-        {"label": generate_random_label(), "description": "test3", "amount_msat": 2},
-    )
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
+    with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
         await nwc.pay_invoice(
-            PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
+            PayInvoiceRequest(id=None, amount=None, invoice=invoice3["bolt11"])
         )
 
 
 @pytest.mark.asyncio
-async def test_multi_pay(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_multi_pay(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2 = node_factory.line_graph(
         2,
         wait_for_announce=True,
@@ -1120,21 +1229,8 @@ async def test_multi_pay(nostr_relay, node_factory, get_plugin):  # noqa: F811
     client_pubkey = PublicKey.parse(uri_res["clientkey_public"])
     LOGGER.info(uri_str)
     uri = NostrWalletConnectUri.parse(uri_str)
-    invoice1 = l2.rpc.call(
-        "invoice",
-        {"label": generate_random_label(), "description": "test1", "amount_msat": 3000},
-    )
-    invoice2 = l2.rpc.call(
-        "invoice",
-        {"label": generate_random_label(), "description": "test2", "amount_msat": 4000},
-    )
-    invoice3 = l2.rpc.call(
-        "invoice",
-        {
-            "label": generate_random_label(),
-            "description": "test3",
-            "amount_msat": 23001,
-        },
+    invoice1, invoice2, invoice3 = await create_invoices(
+        l2, [("test1", 3000), ("test2", 4000), ("test3", 23001)]
     )
     content = {
         "method": "multi_pay_invoice",
@@ -1146,47 +1242,44 @@ async def test_multi_pay(nostr_relay, node_factory, get_plugin):  # noqa: F811
             ],
         },
     }
-    content = json.dumps(content)
     signer = NostrSigner.keys(Keys(uri.secret()))
-    encrypted_content = await signer.nip44_encrypt(uri.public_key(), content)
-    request_event = (
-        await EventBuilder(Kind(23194), encrypted_content)
-        .tags([Tag.public_key(uri.public_key())])
-        .sign(signer)
+    wallet_pubkey = uri.public_key()
+    request_event = await build_request_event(
+        signer, wallet_pubkey, content, nip44=True
     )
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
 
     (responses, _res) = await fetch_event_responses(
         client, client_pubkey, 23195, client.send_event(request_event), 3
     )
 
-    success_pays = []
-    error_pays = []
-    for response in responses:
-        d_tag = response.tags().find(
-            TagKind.SINGLE_LETTER(SingleLetterTag.lowercase(Alphabet.D))
-        )
-        content = await signer.nip44_decrypt(uri.public_key(), response.content())
-        content = json.loads(content)
+    success_pays, error_pays = await classify_responses(
+        signer, wallet_pubkey, responses, nip44=True
+    )
+    for response, content in success_pays:
+        assert content["result_type"] == "multi_pay_invoice"
+        assert response.tags().find(D_TAG_KIND) is not None
+        assert content["result"]["preimage"] is not None
+    for response, content in error_pays:
         assert content["result_type"] == "multi_pay_invoice"
-        if "result" in content and content["result"] is not None:
-            assert d_tag is not None
-            assert content["result"]["preimage"] is not None
-            success_pays.append(content)
-        if "error" in content and content["error"] is not None:
-            assert d_tag.content() == "af3g2k2o11"
-            assert content["error"]["code"] == "QUOTA_EXCEEDED"
-            assert content["error"]["message"] == "Payment exceeds budget!"
-            error_pays.append(content)
+        assert response.tags().find(D_TAG_KIND).content() == "af3g2k2o11"
+        assert content["error"]["code"] == "QUOTA_EXCEEDED"
+        assert content["error"]["message"] == "Payment exceeds budget!"
     assert len(success_pays) == 2
     assert len(error_pays) == 1
+    # one response per requested invoice, matched up by their d tag
+    assert {response.tags().find(D_TAG_KIND).content() for response in responses} == {
+        "4da52c32a1",
+        "3da52c32a1",
+        "af3g2k2o11",
+    }
 
 
 @pytest.mark.asyncio
-async def test_persistency(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_persistency(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2 = node_factory.line_graph(
         2,
         wait_for_announce=True,
@@ -1201,28 +1294,12 @@ async def test_persistency(nostr_relay, node_factory, get_plugin):  # noqa: F811
         ],
     )
     uri_str = l1.rpc.call("nip47-create", ["test1", 3000])["uri"]
-    LOGGER.info(uri_str)
     invoice = l2.rpc.call(
         "invoice",
-        {"label": generate_random_label(), "description": "test1", "amount_msat": 3000},
-    )
-    l1.rpc.call("plugin", {"subcommand": "stop", "plugin": "cln-nip47"})
-    l1.rpc.call(
-        "plugin",
-        {
-            "subcommand": "start",
-            "plugin": str(get_plugin),
-        },
+        {"label": generate_label(), "description": "test1", "amount_msat": 3000},
     )
-    l1.daemon.wait_for_log("All NWC's loaded")
-    time.sleep(3)
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
+    restarted_at = restart_plugin(l1, get_plugin)
+    uri, nwc = await connect_nwc(client, uri_str, restarted_at)
     result = await nwc.pay_invoice(
         PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
     )
@@ -1230,25 +1307,15 @@ async def test_persistency(nostr_relay, node_factory, get_plugin):  # noqa: F811
 
     invoice = l2.rpc.call(
         "invoice",
-        {"label": generate_random_label(), "description": "test1", "amount_msat": 1},
+        {"label": generate_label(), "description": "test1", "amount_msat": 1},
     )
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
+    with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
         await nwc.pay_invoice(
             PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
         )
-    l1.rpc.call("plugin", {"subcommand": "stop", "plugin": "cln-nip47"})
-    l1.rpc.call(
-        "plugin",
-        {
-            "subcommand": "start",
-            "plugin": str(get_plugin),
-        },
-    )
-    l1.daemon.wait_for_log("All NWC's loaded")
-    time.sleep(3)
-    await client.connect()
-    await fetch_info_event(client, uri)
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
+    restarted_at = restart_plugin(l1, get_plugin)
+    await fetch_info_event(client, uri, restarted_at)
+    with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
         await nwc.pay_invoice(
             PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
         )
@@ -1257,21 +1324,10 @@ async def test_persistency(nostr_relay, node_factory, get_plugin):  # noqa: F811
     assert revoke["revoked"] == "test1"
 
     uri_str = l1.rpc.call("nip47-create", ["test1", 3000, "10sec"])["uri"]
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
+    uri, nwc = await connect_nwc(client, uri_str)
 
-    invoice = l2.rpc.call(
-        "invoice",
-        {"label": generate_random_label(), "description": "test1", "amount_msat": 3000},
-    )
-    invoice_exceeded = l2.rpc.call(
-        "invoice",
-        {"label": generate_random_label(), "description": "test1", "amount_msat": 3000},
+    invoice, invoice_exceeded = await create_invoices(
+        l2, [("test1", 3000), ("test1", 3000)]
     )
     result = await nwc.pay_invoice(
         PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
@@ -1281,19 +1337,16 @@ async def test_persistency(nostr_relay, node_factory, get_plugin):  # noqa: F811
     list = l1.rpc.call("nip47-list", ["test1"])[0]
     assert list["test1"]["budget_msat"] == 0
 
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
+    with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
         await nwc.pay_invoice(
             PayInvoiceRequest(id=None, amount=None, invoice=invoice_exceeded["bolt11"])
         )
 
-    time.sleep(11)
-
-    list = l1.rpc.call("nip47-list", ["test1"])[0]
-    assert list["test1"]["budget_msat"] == 3000
+    wait_for_budget(l1, "test1", 3000)
 
     invoice = l2.rpc.call(
         "invoice",
-        {"label": generate_random_label(), "description": "test1", "amount_msat": 3000},
+        {"label": generate_label(), "description": "test1", "amount_msat": 3000},
     )
     result = await nwc.pay_invoice(
         PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
@@ -1303,38 +1356,28 @@ async def test_persistency(nostr_relay, node_factory, get_plugin):  # noqa: F811
     list = l1.rpc.call("nip47-list", ["test1"])[0]
     assert list["test1"]["budget_msat"] == 0
 
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
+    with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
         await nwc.pay_invoice(
             PayInvoiceRequest(id=None, amount=None, invoice=invoice_exceeded["bolt11"])
         )
 
-    l1.rpc.call("plugin", {"subcommand": "stop", "plugin": "cln-nip47"})
-    l1.rpc.call(
-        "plugin",
-        {
-            "subcommand": "start",
-            "plugin": str(get_plugin),
-        },
-    )
-    l1.daemon.wait_for_log("All NWC's loaded")
-    time.sleep(3)
-    await client.connect()
-    await fetch_info_event(client, uri)
+    restarted_at = restart_plugin(l1, get_plugin)
+    await fetch_info_event(client, uri, restarted_at)
 
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
+    with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
         await nwc.pay_invoice(
             PayInvoiceRequest(id=None, amount=None, invoice=invoice_exceeded["bolt11"])
         )
 
-    time.sleep(11)
-
-    list = l1.rpc.call("nip47-list", ["test1"])[0]
-    assert list["test1"]["budget_msat"] == 3000
+    wait_for_budget(l1, "test1", 3000)
 
 
 @pytest.mark.asyncio
-async def test_budget_command(nostr_relay, node_factory, get_plugin):  # noqa: F811
+async def test_budget_command(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
     url = nostr_relay
+    client = nostr_client
     l1, l2 = node_factory.line_graph(
         2,
         wait_for_announce=True,
@@ -1349,108 +1392,79 @@ async def test_budget_command(nostr_relay, node_factory, get_plugin):  # noqa: F
         ],
     )
     uri_str = l1.rpc.call("nip47-create", ["test1", 3000])["uri"]
-    LOGGER.info(uri_str)
     invoice = l2.rpc.call(
         "invoice",
-        {"label": generate_random_label(), "description": "test1", "amount_msat": 5000},
+        {"label": generate_label(), "description": "test1", "amount_msat": 5000},
     )
-    uri = NostrWalletConnectUri.parse(uri_str)
-    signer = NostrSigner.keys(Keys(uri.secret()))
-    client = Client(signer)
-    await client.add_relay(RelayUrl.parse(url))
-    await client.connect()
-    await fetch_info_event(client, uri)
-    nwc = Nwc(uri)
-    balance = await nwc.get_balance()
-    assert balance == 3000
+    uri, nwc = await connect_nwc(client, uri_str)
+    async with watch_info_events(client, uri) as info_events:
+        balance = await nwc.get_balance()
+        assert balance == 3000
 
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
-        await nwc.pay_invoice(
-            PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
-        )
+        with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
+            await nwc.pay_invoice(
+                PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
+            )
 
-    l1.rpc.call("nip47-budget", ["test1", 4000])
-    balance = await nwc.get_balance()
-    assert balance == 4000
+        await set_budget_and_verify(l1, nwc, "test1", 4000)
 
-    with pytest.raises(NostrSdkError.Generic, match="Payment exceeds budget"):
-        await nwc.pay_invoice(
-            PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
-        )
+        with pytest.raises(NostrSdkError.Generic, match=BUDGET_EXCEEDED_RE):
+            await nwc.pay_invoice(
+                PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
+            )
 
-    l1.rpc.call("nip47-budget", ["test1", 5000, "15s"])
-    balance = await nwc.get_balance()
-    assert balance == 5000
+        budget_set_at = time.monotonic()
+        await set_budget_and_verify(l1, nwc, "test1", 5000, "15s")
 
-    with pytest.raises(
-        RpcError, match="`budget_msat` must be greater than 0 if you use `interval`"
-    ):
-        l1.rpc.call("nip47-budget", ["test1", 0, "1s"])
+        with pytest.raises(RpcError) as err:
+            await asyncio.to_thread(l1.rpc.call, "nip47-budget", ["test1", 0, "1s"])
+        assert "`budget_msat` must be greater than 0 if you use `interval`" in str(
+            err.value
+        )
 
-    pay = await nwc.pay_invoice(
-        PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
-    )
-    assert pay.preimage is not None
+        pay = await nwc.pay_invoice(
+            PayInvoiceRequest(id=None, amount=None, invoice=invoice["bolt11"])
+        )
+        assert pay.preimage is not None
 
-    balance = await nwc.get_balance()
-    assert balance == 0
+        balance, get_info, info_event = await asyncio.gather(
+            nwc.get_balance(), nwc.get_info(), info_events.wait_for()
+        )
+        assert balance == 0
+        assert_capabilities(get_info, info_event, read_only=False, notifications=True)
 
-    get_info = await nwc.get_info()
-    assert get_info.methods == [
-        Method.MAKE_INVOICE,
-        Method.LOOKUP_INVOICE,
-        Method.LIST_TRANSACTIONS,
-        Method.GET_BALANCE,
-        Method.GET_INFO,
-        Method.PAY_INVOICE,
-        Method.MULTI_PAY_INVOICE,
-        Method.PAY_KEYSEND,
-        Method.MULTI_PAY_KEYSEND,
-    ]
+        # the budget resets 15s after it was set, no point in polling before that
+        await asyncio.sleep(max(0, 14 - (time.monotonic() - budget_set_at)))
+        await wait_until(nwc.get_balance, lambda b: b == 5000, timeout=20)
 
-    info_event = await fetch_info_event(client, uri)
 
-    assert (
-        info_event.content()
-        == "make_invoice lookup_invoice list_transactions get_balance get_info pay_invoice multi_pay_invoice pay_keysend multi_pay_keysend notifications"
-    )
-    assert (
-        info_event.tags().find(TagKind.UNKNOWN("encryption")).content()
-        == "nip44_v2 nip04"
-    )
-    assert (
-        info_event.tags().find(TagKind.UNKNOWN("notifications")).content()
-        == "payment_received payment_sent"
+@pytest.mark.asyncio
+async def test_budget_read_only(
+    nostr_relay, nostr_client, node_factory, get_plugin  # noqa: F811
+):
+    url = nostr_relay
+    client = nostr_client
+    l1 = node_factory.get_node(
+        options={
+            "log-level": "debug",
+            "plugin": get_plugin,
+            "nip47-relays": url,
+        },
+        broken_log=r"Relay receiver exited with error|Connection failed",
     )
+    uri_str = l1.rpc.call("nip47-create", ["test1", 5000, "15s"])["uri"]
+    uri, nwc = await connect_nwc(client, uri_str)
+    async with watch_info_events(client, uri) as info_events:
+        get_info, info_event = await asyncio.gather(
+            nwc.get_info(), info_events.wait_for()
+        )
+        assert_capabilities(get_info, info_event, read_only=False, notifications=True)
 
-    time.sleep(18)
-
-    balance = await nwc.get_balance()
-    assert balance == 5000
-
-    l1.rpc.call("nip47-budget", ["test1", 0])
-    balance = await nwc.get_balance()
-    assert balance == 0
-
-    get_info = await nwc.get_info()
-    assert get_info.methods == [
-        Method.MAKE_INVOICE,
-        Method.LOOKUP_INVOICE,
-        Method.LIST_TRANSACTIONS,
-        Method.GET_BALANCE,
-        Method.GET_INFO,
-    ]
+        await set_budget_and_verify(l1, nwc, "test1", 0)
 
-    info_event = await fetch_info_event(client, uri)
-    assert (
-        info_event.content()
-        == "make_invoice lookup_invoice list_transactions get_balance get_info notifications"
-    )
-    assert (
-        info_event.tags().find(TagKind.UNKNOWN("encryption")).content()
-        == "nip44_v2 nip04"
-    )
-    assert (
-        info_event.tags().find(TagKind.UNKNOWN("notifications")).content()
-        == "payment_received payment_sent"
-    )
+        # going read-only republishes the info event, wait for that one
+        get_info, info_event = await asyncio.gather(
+            nwc.get_info(),
+            info_events.wait_for(lambda e: "pay_invoice" not in e.content()),
+        )
+        assert_capabilities(get_info, info_event, read_only=True, notifications=True)
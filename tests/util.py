@@ -1,7 +1,8 @@
+import itertools
 import logging
 import os
 import random
-import string
+import re
 from pathlib import Path
 
 import pytest
@@ -10,10 +11,11 @@ RUST_PROFILE = os.environ.get("RUST_PROFILE", "debug")
 plugin_dir = Path(__file__).parent.parent.resolve()
 COMPILED_PATH = plugin_dir / "target" / RUST_PROFILE / "cln-nip47"
 DOWNLOAD_PATH = plugin_dir / "tests" / "cln-nip47"
+_label_counter = itertools.count()
 
 
-@pytest.fixture
-def get_plugin(directory):
+@pytest.fixture(scope="session")
+def get_plugin():
     if COMPILED_PATH.is_file():
         return COMPILED_PATH
     elif DOWNLOAD_PATH.is_file():
@@ -22,12 +24,8 @@ def get_plugin(directory):
         raise ValueError("No files were found.")
 
 
-def generate_random_label():
-    label_length = 8
-    random_label = "".join(
-        random.choice(string.ascii_letters) for _ in range(label_length)
-    )
-    return random_label
+def generate_label():
+    return f"lbl_{next(_label_counter)}"
 
 
 def generate_random_number():
@@ -44,15 +42,13 @@ def pay_with_thread(rpc, bolt11):
 
 
 def update_config_file_option(lightning_dir, option_name, option_value):
-    with open(lightning_dir + "/config", "r") as file:
-        lines = file.readlines()
-
-    for i, line in enumerate(lines):
-        if line.startswith(option_name):
-            lines[i] = option_name + "=" + option_value + "\n"
-
-    with open(lightning_dir + "/config", "w") as file:
-        file.writelines(lines)
+    config_file = Path(lightning_dir) / "config"
+    option_line = re.compile(rf"^{re.escape(option_name)}.*$", re.MULTILINE)
+    config_file.write_text(
+        option_line.sub(
+            lambda _: f"{option_name}={option_value}", config_file.read_text()
+        )
+    )
 
 
 def experimental_anchors_check(node_factory):